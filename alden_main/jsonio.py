@@ -0,0 +1,34 @@
+"""
+JSON encode/decode helpers.
+Uses orjson when it is installed and falls back to the stdlib json module.
+Both paths speak bytes, so callers can write straight to binary handles.
+"""
+import datetime
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    import json
+
+
+def _iso_default(obj: Any) -> Any:
+    # orjson encodes datetimes natively; match that on the stdlib path
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, default=default or _iso_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
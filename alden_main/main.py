@@ -1,14 +1,31 @@
+import asyncio
+import atexit
 import datetime
-import json
-from fastapi import FastAPI, Request
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, BinaryIO, Dict, List, Optional
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from alden_main.main_agents.data_collector import validate, store_data, init_db
-from alden_main.main_agents.routes_calendar import router as caldav_router
+from alden_main import jsonio
+from alden_main.jsonio import dumps, loads
+from alden_main.main_agents.data_collector import validate, store_data, store_data_many, init_db, close_db
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./alden.db")
+
+log = logging.getLogger("alden")
+log.setLevel(os.getenv("ALDEN_LOG", "WARNING").upper())
+if not log.handlers:
+    log.addHandler(logging.StreamHandler())
 
 # -----------------------
 # MODELS
@@ -40,119 +57,333 @@ class User(BaseModel):
     created_at: datetime.datetime = Field(default_factory=lambda: datetime.datetime.utcnow())
 
 # -----------------------
-# APP
+# CLOCK
+# -----------------------
+# A startup task refreshes this once a second so hot paths read a string
+# instead of building and formatting a datetime per request.
+_NOW_ISO: Optional[str] = None
+
+def _now_iso() -> str:
+    return _NOW_ISO or datetime.datetime.utcnow().isoformat(timespec="seconds")
+
+async def _clock_loop():
+    global _NOW_ISO
+    while True:
+        _NOW_ISO = datetime.datetime.utcnow().isoformat(timespec="seconds")
+        await asyncio.sleep(1)
+
+# -----------------------
+# ROUTER
 # -----------------------
-app = FastAPI(title="Alden API")
-init_db()
-app.include_router(caldav_router)
+router = APIRouter()
 
-@app.get("/ping")
+@router.get("/ping")
 def ping():
-    return {"status": "ok", "time": datetime.datetime.utcnow().isoformat()}
+    return {"status": "ok", "time": _now_iso()}
+
+# -----------------------
+# JSONL LOGS
+# -----------------------
+# Handles are buffered and flushed on a timer (and at exit), so a burst
+# of entries costs one write() per flush rather than one per request.
+_HANDLES: Dict[str, BinaryIO] = {}
+_HANDLES_LOCK = threading.Lock()
+LOG_TIMESTAMPS = True
+LOG_BUFFER_BYTES = 1 << 16
+LOG_FLUSH_SECONDS = 1.0
 
-@app.post("/shortcut-test")
+def append_log(filename: str, entry: dict) -> None:
+    """Append one JSON line, keeping the file open between calls.
+    Stamps entry["timestamp"] here so callers don't format one themselves."""
+    if LOG_TIMESTAMPS:
+        entry["timestamp"] = _now_iso()
+    line = dumps(entry) + b"\n"
+    with _HANDLES_LOCK:
+        f = _HANDLES.get(filename)
+        if f is None:
+            f = _HANDLES[filename] = open(filename, "ab", buffering=LOG_BUFFER_BYTES)
+        f.write(line)
+
+def flush_logs() -> None:
+    with _HANDLES_LOCK:
+        for f in _HANDLES.values():
+            f.flush()
+
+def close_logs() -> None:
+    with _HANDLES_LOCK:
+        for f in _HANDLES.values():
+            f.close()
+        _HANDLES.clear()
+
+atexit.register(close_logs)
+
+async def _flush_logs_loop():
+    while True:
+        await asyncio.sleep(LOG_FLUSH_SECONDS)
+        flush_logs()
+
+@router.post("/shortcut-test")
 async def shortcut_test(request: Request):
-    data = await request.json()
-    entry = {"timestamp": datetime.datetime.utcnow().isoformat(), "data": data}
-    with open("shortcut_logs.jsonl", "a") as f:
-        f.write(json.dumps(entry) + "\n")
-    print("📥 SHORTCUT TEST:", entry)
+    data = loads(await request.body())
+    entry = {"data": data}
+    append_log("shortcut_logs.jsonl", entry)
+    log.debug("📥 SHORTCUT TEST: %s", entry)
     return {"received": data, "status": "logged"}
 
-def _unwrap_json(data: dict):
-    """Handle Shortcuts wrapping everything in a 'json' key"""
-    if isinstance(data, dict) and "json" in data and isinstance(data["json"], str):
+# -----------------------
+# SHORTCUTS ENVELOPE
+# -----------------------
+# Shortcuts wraps the real payload as {"json": "<escaped JSON>"}. The
+# middleware below swaps the body for the inner payload before FastAPI
+# parses it, so the ingestion handlers can bind their models directly.
+_INGEST_PATHS = frozenset({"/location", "/usage", "/user"})
+_SHORTCUTS_KEY = b'"json"'
+
+def _unwrap_body(raw: bytes) -> bytes:
+    """Return the inner payload of a Shortcuts envelope, or raw unchanged"""
+    # Cheap screen first: plain payloads never mention the key, so they
+    # skip the extra parse. Envelopes usually lead with it, but any
+    # whitespace or key order is accepted.
+    if _SHORTCUTS_KEY not in raw:
+        return raw
+    try:
+        data = loads(raw)
+    except Exception:
+        return raw  # let FastAPI report the malformed body
+    if not isinstance(data, dict) or not isinstance(data.get("json"), str):
+        return raw
+    inner = data["json"]
+    # a malformed inner payload surfaces as a validation error downstream
+    return inner.encode("utf-8")
+
+class ShortcutsEnvelopeMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in _INGEST_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return  # client went away before sending the body
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = _unwrap_body(b"".join(chunks))
+
+        headers = [(k, v) for k, v in scope["headers"] if k != b"content-length"]
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        scope = dict(scope, headers=headers)
+
+        replayed = False
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, replay, send)
+
+async def _ingest_validation_error(request: Request, exc: RequestValidationError):
+    # Ingestion clients (Shortcuts) expect a 200 with ok=False, not a 422
+    if request.url.path not in _INGEST_PATHS:
+        return await request_validation_exception_handler(request, exc)
+    log.warning("❌ invalid %s payload: %s", request.url.path, exc.errors())
+    return JSONResponse(jsonable_encoder({"ok": False, "error": str(exc), "raw": exc.body}))
+
+# -----------------------
+# WRITE BATCHING
+# -----------------------
+# Endpoints enqueue rows and await a future; one flusher task drains
+# whatever has queued up and commits it in a single transaction. The
+# commit runs on a dedicated single-thread executor so the event loop keeps
+# serving requests (which queue up as the next batch) meanwhile.
+_WRITE_BATCH_MAX = 256
+_WRITE_Q: Optional[asyncio.Queue] = None
+_FLUSHER: Optional[asyncio.Task] = None
+_WRITER: Optional[ThreadPoolExecutor] = None
+
+async def _flush_writes(q: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        batch = [await q.get()]
+        while len(batch) < _WRITE_BATCH_MAX and not q.empty():
+            batch.append(q.get_nowait())
+        # None is the shutdown sentinel; it is always the last item queued
+        if batch[-1] is None:
+            batch.pop()
+            stopping = True
+            if not batch:
+                break
+        items = [(category, payload) for category, payload, _ in batch]
         try:
-            return json.loads(data["json"])
+            results = await loop.run_in_executor(_WRITER, store_data_many, items)
         except Exception as e:
-            print("❌ Failed to parse inner JSON:", e)
-            return data
-    return data
+            results = [e] * len(batch)
+        for (_, _, fut), res in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(res, Exception):
+                fut.set_exception(res)
+            else:
+                fut.set_result(res)
+
+async def _store(category: str, payload: Dict[str, Any]) -> int:
+    if _WRITE_Q is None:
+        # batcher not started (app built without create_app): write directly
+        return await asyncio.to_thread(store_data, category, payload)
+    fut = asyncio.get_running_loop().create_future()
+    await _WRITE_Q.put((category, payload, fut))
+    return await fut
+
+def start_write_batcher() -> None:
+    global _WRITE_Q, _FLUSHER, _WRITER
+    _WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alden-sqlite")
+    _WRITE_Q = asyncio.Queue()
+    _FLUSHER = asyncio.create_task(_flush_writes(_WRITE_Q))
+
+async def stop_write_batcher() -> None:
+    """Stop taking new rows, commit everything already queued, then stop the writer."""
+    global _WRITE_Q, _FLUSHER, _WRITER
+    q, _WRITE_Q = _WRITE_Q, None  # later _store() calls write directly
+    if q is not None:
+        q.put_nowait(None)
+    if _FLUSHER is not None:
+        await _FLUSHER
+    if _WRITER is not None:
+        _WRITER.shutdown(wait=True)
+    _FLUSHER = _WRITER = None
 
 # -----------------------
 # ENDPOINTS
 # -----------------------
-@app.post("/location")
-async def post_location(request: Request):
-    data = await request.json()
-    data = _unwrap_json(data)
-    print("📥 RAW LOCATION DATA:", data)
+def _json_response(content: Dict[str, Any]) -> Response:
+    # Encode once; returning a dict would also run FastAPI's jsonable_encoder
+    return Response(dumps(content), media_type="application/json")
 
+@router.post("/location")
+async def post_location(ev: LocationEvent):
+    payload = ev.model_dump()
     try:
-        ev = LocationEvent(**data)
-        payload = ev.dict()
-        row_id = store_data("LOCATION", payload)
-        print("✅ STORED LOCATION:", payload)
-        return {"ok": True, "id": row_id, "stored": payload}
+        row_id = await _store("LOCATION", payload)
+        log.debug("✅ STORED LOCATION: %s", payload)
+        return _json_response({"ok": True, "id": row_id, "stored": payload})
     except Exception as e:
-        print("❌ ERROR storing LOCATION:", e)
-        return {"ok": False, "error": str(e), "raw": data}
-
-@app.post("/usage")
-async def post_usage(request: Request):
-    data = await request.json()
-    data = _unwrap_json(data)
-    print("📥 RAW USAGE DATA:", data)
+        log.exception("❌ ERROR storing LOCATION")
+        return _json_response({"ok": False, "error": str(e), "raw": payload})
 
+@router.post("/usage")
+async def post_usage(ev: UsageEvent):
+    payload = ev.model_dump()
     try:
-        ev = UsageEvent(**data)
-        payload = ev.dict()
-        row_id = store_data("USAGE", payload)
-        print("✅ STORED USAGE:", payload)
-        return {"ok": True, "id": row_id, "stored": payload}
+        row_id = await _store("USAGE", payload)
+        log.debug("✅ STORED USAGE: %s", payload)
+        return _json_response({"ok": True, "id": row_id, "stored": payload})
     except Exception as e:
-        print("❌ ERROR storing USAGE:", e)
-        return {"ok": False, "error": str(e), "raw": data}
-
-@app.post("/user")
-async def post_user(request: Request):
-    data = await request.json()
-    data = _unwrap_json(data)
-    print("📥 RAW USER DATA:", data)
+        log.exception("❌ ERROR storing USAGE")
+        return _json_response({"ok": False, "error": str(e), "raw": payload})
 
+@router.post("/user")
+async def post_user(ev: User):
+    payload = ev.model_dump()
     try:
-        ev = User(**data)
-        payload = ev.dict()
-        row_id = store_data("USER", payload)
-        print("✅ STORED USER:", payload)
-        return {"ok": True, "id": row_id, "stored": payload}
+        row_id = await _store("USER", payload)
+        log.debug("✅ STORED USER: %s", payload)
+        return _json_response({"ok": True, "id": row_id, "stored": payload})
     except Exception as e:
-        print("❌ ERROR storing USER:", e)
-        return {"ok": False, "error": str(e), "raw": data}
+        log.exception("❌ ERROR storing USER")
+        return _json_response({"ok": False, "error": str(e), "raw": payload})
 
-import os, asyncio
-from fastapi import FastAPI
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from alden_main.models.models_calendar import Base
-from alden_main.main_agents.caldav_client import AldenCalDAV
-from alden_main.main_agents.calendar_sync import poll_loop
+# -----------------------
+# APP
+# -----------------------
+# Strong refs to the long-running startup tasks: the event loop only holds
+# weak ones, and shutdown needs them to cancel.
+_BG_TASKS: List[asyncio.Task] = []
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./alden.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
-Base.metadata.create_all(engine)
+def create_app() -> FastAPI:
+    """
+    Build the API: ingestion routes, CalDAV routes and the calendar poller.
+    Opening the DBs and connecting to CalDAV happens here rather than at
+    import time, so importing this module (tests, tooling) stays cheap.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from alden_main.models.models_calendar import Base, add_missing_columns, drop_stale_indexes
+    from alden_main.main_agents.caldav_client import AldenCalDAV
+    from alden_main.main_agents.calendar_sync import poll_loop
+    from alden_main.main_agents.routes_calendar import router as caldav_router, mount_calendar_routes
 
-caldav = AldenCalDAV()
+    init_db()
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+    SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    drop_stale_indexes(engine)
 
-app = FastAPI()
+    caldav = AldenCalDAV()
 
-@app.on_event("startup")
-def startup():
-    app.state.caldav = AldenCalDAV()
-    # Optional: try a light touch to log readiness, but don’t crash on failure
-    try:
-        _ = app.state.caldav.get_calendars()
-        print("✅ CalDAV reachable")
-    except Exception as e:
-        print(f"⚠️ CalDAV not reachable yet: {e}")
+    # ORJSONResponse needs orjson; fall back to the stock encoder without it
+    response_class = ORJSONResponse if jsonio.orjson is not None else JSONResponse
+    app = FastAPI(title="Alden API", default_response_class=response_class)
+    app.add_middleware(ShortcutsEnvelopeMiddleware)
+    app.add_exception_handler(RequestValidationError, _ingest_validation_error)
+    app.include_router(router)
+    app.include_router(caldav_router, prefix="/calendar")
+    mount_calendar_routes(app, SessionLocal, caldav)
+
+    @app.on_event("startup")
+    def startup():
+        # Optional: try a light touch to log readiness, but don’t crash on failure
+        try:
+            _ = app.state.caldav.get_calendars()
+            log.info("✅ CalDAV reachable")
+        except Exception as e:
+            log.warning("⚠️ CalDAV not reachable yet: %s", e)
+
+    @app.on_event("startup")
+    async def _startup():
+        start_write_batcher()
+        _BG_TASKS.extend([
+            asyncio.create_task(_clock_loop()),
+            asyncio.create_task(_flush_logs_loop()),
+            asyncio.create_task(poll_loop(caldav, SessionLocal, int(os.getenv("POLL_SECONDS","60")))),
+        ])
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        for task in _BG_TASKS:
+            task.cancel()
+        await asyncio.gather(*_BG_TASKS, return_exceptions=True)
+        _BG_TASKS.clear()
+        await stop_write_batcher()
+        close_logs()  # final flush, now that nothing else writes to the buffers
+        close_db()
 
-app.include_router(caldav_router, prefix="/calendar")
+    return app
 
-@app.on_event("startup")
-async def _startup():
-    asyncio.create_task(poll_loop(caldav, SessionLocal, int(os.getenv("POLL_SECONDS","60"))))
-    
-from alden_main.main_agents.routes_calendar import mount_calendar_routes
-mount_calendar_routes(app, SessionLocal, caldav)
+def __getattr__(name: str):
+    # `uvicorn alden_main.main:app` resolves the app lazily through here
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+if __name__ == "__main__":
+    # python -m alden_main.main — pin the C event loop and HTTP parser
+    # (both in requirements.txt) rather than relying on uvicorn's "auto".
+    import uvicorn
+    uvicorn.run(
+        "alden_main.main:app",
+        host=os.getenv("ALDEN_HOST", "0.0.0.0"),
+        port=int(os.getenv("ALDEN_PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+    )
@@ -1,9 +1,9 @@
 # backend/agents/activity_guesser.py
 from __future__ import annotations
-from typing import Dict, Any
-import json, os
-from datetime import datetime, timezone
-from models.gpt5nano import run_gpt5nano
+from typing import Dict, Any, BinaryIO, Optional
+import atexit, os, threading, time
+from alden_main.models.gpt5nano import run_gpt5nano
+from alden_main.jsonio import dumps, loads
 
 def guess(feature_bundle: Dict[str, Any], *, api_mode: bool = False, debug: bool = False) -> Dict[str, Any]:
     system_prompt = """You are an assistant that infers a user's most likely activity
@@ -24,7 +24,7 @@ Example output:
 
     messages = [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": json.dumps(feature_bundle, ensure_ascii=False)},
+        {"role": "user", "content": dumps(feature_bundle).decode("utf-8")},
     ]
 
     if not api_mode:
@@ -41,7 +41,7 @@ Example output:
         return {"status": "ok", "guess": result}
     if api_mode:
         raw_output = run_gpt5nano(messages, debug=debug)
-        result = json.loads(raw_output)  # however you currently parse GPT output
+        result = loads(raw_output)  # however you currently parse GPT output
         log_activity(result, debug=debug)
         return result
     
@@ -51,19 +51,57 @@ LOG_PATH = os.path.join(
     "activity_log.jsonl"
 )
 
+# One buffered handle for the process instead of makedirs+open per guess.
+_LOG_FH: Optional[BinaryIO] = None
+_LOG_LOCK = threading.Lock()
+LOG_FLUSH_SECONDS = 1.0  # longest a written entry sits in the buffer
+_FLUSHER: Optional[threading.Thread] = None
+
+def _flush_loop() -> None:
+    while True:
+        time.sleep(LOG_FLUSH_SECONDS)
+        flush_activity_log()
+
+def _log_handle() -> BinaryIO:
+    global _LOG_FH, _FLUSHER
+    if _LOG_FH is None:
+        os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+        _LOG_FH = open(LOG_PATH, "ab", buffering=1 << 16)
+    if _FLUSHER is None:
+        # daemon: never blocks exit; atexit does the final flush
+        _FLUSHER = threading.Thread(target=_flush_loop, name="alden-activity-log", daemon=True)
+        _FLUSHER.start()
+    return _LOG_FH
+
+def flush_activity_log() -> None:
+    with _LOG_LOCK:
+        if _LOG_FH is not None:
+            _LOG_FH.flush()
+
+def close_activity_log() -> None:
+    global _LOG_FH
+    with _LOG_LOCK:
+        if _LOG_FH is not None:
+            _LOG_FH.close()
+            _LOG_FH = None
+
+atexit.register(close_activity_log)
+
 def log_activity(activity_data: dict, debug: bool = False) -> None:
     """
     Append an activity guess to the log file with a UTC timestamp.
     Uses JSON Lines format so it can be read incrementally.
+    Writes are buffered; a background thread flushes them every
+    LOG_FLUSH_SECONDS, and flush_activity_log() forces it sooner.
     """
     entry = {
-        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
         "activity": activity_data
     }
     if debug:
         print(f"[LOG_ACTIVITY] {entry}")
-    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry) + "\n")
+    line = dumps(entry) + b"\n"
+    with _LOG_LOCK:
+        _log_handle().write(line)
     if debug:
-        print(f"[LOG_ACTIVITY] Activity logged to {LOG_PATH}")
\ No newline at end of file
+        print(f"[LOG_ACTIVITY] Activity logged to {LOG_PATH}")
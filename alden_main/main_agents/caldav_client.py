@@ -1,13 +1,21 @@
+import json
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any, Tuple
+from typing import Iterable, List, Optional, Dict, Any, Tuple
+from urllib.parse import quote
 
-import pytz
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from dateutil import tz
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from icalendar import Calendar, Event, Alarm, vText
 from caldav import DAVClient, Calendar as CalDAVCalendar, Principal
-from caldav.lib.error import NotFoundError
+from caldav.elements import cdav, dav
+from caldav.elements.base import ValuedBaseElement
+from caldav.lib.error import DAVError, NotFoundError, ReportError
+from caldav.lib.url import URL
 from caldav.objects import Principal
 
 # -----------------------------
@@ -18,10 +26,60 @@ CALDAV_USER = os.getenv("CALDAV_USER", "")
 CALDAV_PASS = os.getenv("CALDAV_PASS", "")
 DEFAULT_CAL_NAME = os.getenv("CALDAV_CAL_NAME", "Alden")
 DEFAULT_TZ = os.getenv("ALDEN_TZ", "America/Boise")
+CALDAV_FETCH_WORKERS = int(os.getenv("CALDAV_FETCH_WORKERS", "8"))
+MULTIGET_PAGE = 500  # hrefs per calendar-multiget REPORT
 
-def _tz():
-    # pytz for iCalendar’s expectations
-    return pytz.timezone(DEFAULT_TZ)
+try:
+    # icalendar handles zoneinfo natively; resolve the zone once per process
+    _TZ = ZoneInfo(DEFAULT_TZ)
+except ZoneInfoNotFoundError:
+    # no system tz database (e.g. Windows without tzdata)
+    import pytz
+    _TZ = pytz.timezone(DEFAULT_TZ)
+
+# Resolved calendar URLs, keyed by (server, user, calendar name). Kept in
+# memory and on disk so new clients/processes skip calendar discovery.
+_CAL_URL_CACHE = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "alden", "caldav_cal_url")
+_CAL_URLS: Dict[str, str] = {}
+
+def _load_cal_urls() -> Dict[str, str]:
+    if not _CAL_URLS:
+        try:
+            with open(_CAL_URL_CACHE, encoding="utf-8") as f:
+                _CAL_URLS.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return _CAL_URLS
+
+def _save_cal_url(key: str, url: Optional[str]) -> None:
+    """Remember url for key; None forgets it."""
+    if url is None:
+        _CAL_URLS.pop(key, None)
+    else:
+        _CAL_URLS[key] = url
+    try:
+        os.makedirs(os.path.dirname(_CAL_URL_CACHE), exist_ok=True)
+        with open(_CAL_URL_CACHE, "w", encoding="utf-8") as f:
+            json.dump(_CAL_URLS, f)
+    except OSError:
+        pass  # cache is best-effort
+
+def sync_token_rejected(exc: Exception) -> bool:
+    """
+    True if exc is the server refusing a sync token (RFC 6578: 403/409 with
+    a valid-sync-token precondition), as opposed to a transport or server
+    failure worth retrying with the same token.
+    """
+    if not isinstance(exc, ReportError):
+        return False
+    # caldav puts "<status> <reason>\n\n<body>" into the url slot
+    text = f"{exc.url or ''} {exc.reason}"
+    return "valid-sync-token" in text or text.lstrip().startswith(("403", "409"))
+
+class _GetCTag(ValuedBaseElement):
+    # calendarserver.org collection tag: changes whenever anything in the calendar does
+    tag = "{http://calendarserver.org/ns/}getctag"
 
 # -----------------------------
 # Core client
@@ -40,17 +98,32 @@ class AldenCalDAV:
         # init placeholders BEFORE any method call
         self._client: Optional[DAVClient] = None
         self._principal: Optional[Principal] = None
+        # UID -> event href, filled by full scans and create_event so
+        # repeat lookups are a single GET instead of a calendar-wide scan
+        self._uid_index: Dict[str, str] = {}
 
         # ensure we have a calendar object
         self.calendar: CalDAVCalendar = self._ensure_calendar(self.calendar_name)
 
-    def _ensure_connected(self):
+    def _ensure_client(self) -> DAVClient:
         if self._client is None:
             self._client = DAVClient(
                 url=self.url,
                 username=self.username,
                 password=self.password,
             )
+            # One requests.Session for the client's lifetime, so poll ticks reuse
+            # kept-alive connections. The pool must cover CALDAV_FETCH_WORKERS or
+            # concurrent GETs open throwaway sockets instead of reusing them.
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=max(10, CALDAV_FETCH_WORKERS),
+                                  max_retries=Retry(total=3, backoff_factor=0.2))
+            self._client.session.mount("http://", adapter)
+            self._client.session.mount("https://", adapter)
+        return self._client
+
+    def _ensure_connected(self):
+        self._ensure_client()
         if self._principal is None:
             self._principal = self._client.principal()
 
@@ -59,21 +132,37 @@ class AldenCalDAV:
         return self._principal.calendars()
 
     def _ensure_calendar(self, name: str) -> CalDAVCalendar:
+        key = f"{self.username}@{self.url}#{name}"
+        cached = _load_cal_urls().get(key)
+        if cached:
+            # One depth-0 PROPFIND instead of principal + calendar-home
+            # discovery. A calendar that was deleted, moved or renamed since
+            # it was cached is dropped from the cache and looked up again.
+            cal = self._ensure_client().calendar(url=cached)
+            try:
+                disp = cal.get_properties([dav.DisplayName()]).get(dav.DisplayName.tag)
+            except DAVError:
+                disp = None
+            if (isinstance(disp, bytes) and disp.decode() == name) or disp == name:
+                return cal
+            _save_cal_url(key, None)
+
         self._ensure_connected()   # <— make sure client & principal exist
 
-        calendars = self._principal.calendars()
-        for c in calendars:
-            try:
-                props = c.get_properties([("{DAV:}", "displayname")])
-                disp = props.get(("{DAV:}", "displayname"))
-                if (isinstance(disp, bytes) and disp.decode() == name) or disp == name:
-                    return c
-            except Exception:
-                pass
+        # calendars() is one depth=1 PROPFIND that already carries each
+        # displayname, so no per-calendar property lookups are needed
+        found = None
+        for c in self._principal.calendars():
+            disp = c.name
+            if (isinstance(disp, bytes) and disp.decode() == name) or disp == name:
+                found = c
+                break
 
         # Not found → create one
-        new_cal = self._principal.make_calendar(name)
-        return new_cal
+        if found is None:
+            found = self._principal.make_calendar(name)
+        _save_cal_url(key, str(found.url))
+        return found
 
     # -------------------------
     # ICS helpers
@@ -89,9 +178,8 @@ class AldenCalDAV:
                    rrule: Optional[str] = None,
                    categories: Optional[List[str]] = None,
                    x_alden: Optional[Dict[str, str]] = None) -> bytes:
-        tzinfo = _tz()
-        start = start.astimezone(tzinfo)
-        end = end.astimezone(tzinfo)
+        start = start.astimezone(_TZ)
+        end = end.astimezone(_TZ)
 
         cal = Calendar()
         cal.add("prodid", "-//Alden//CalDAV//EN")
@@ -103,7 +191,7 @@ class AldenCalDAV:
         ev.add("summary", vText(summary))
         ev.add("dtstart", start)
         ev.add("dtend", end)
-        ev.add("dtstamp", datetime.now(tzinfo))
+        ev.add("dtstamp", datetime.now(_TZ))
         if description:
             ev.add("description", vText(description))
         if location:
@@ -148,19 +236,46 @@ class AldenCalDAV:
         ics = self._build_ics(summary, start, end, description, location, uid,
                               alarms_minutes, rrule, categories, x_alden)
         ev = self.calendar.add_event(ics)
-        return ev.icalendar_instance["UID"]
+        new_uid = ev.icalendar_instance["UID"]
+        self._uid_index[str(new_uid)] = str(ev.url)
+        return new_uid
 
     def get_event_by_uid(self, uid: str):
-        # Radicale supports searching; simplest is to iterate events and match UID
+        href = self._uid_index.get(uid)
+        if href is not None:
+            try:
+                return self.calendar.event_by_url(href)
+            except NotFoundError:
+                # moved or deleted behind our back; fall through to a scan
+                self._uid_index.pop(uid, None)
+
+        # Server-side calendar-query REPORT with a UID text-match: only the
+        # matching resource comes back, instead of the whole calendar.
+        try:
+            ev = self.calendar.event_by_uid(uid)
+            self._uid_index[uid] = str(ev.url)
+            return ev
+        except NotFoundError:
+            raise
+        except Exception:
+            pass  # server can't do UID queries; fall back to a scan
+
+        # Last resort: iterate events and match UID.
+        # Index every event we parse so later lookups skip the scan.
+        found = None
         for e in self.calendar.events():
             try:
                 cal = e.icalendar_instance
                 if "UID" in cal.subcomponents[0]:
-                    if str(cal.subcomponents[0]["UID"]) == uid:
-                        return e
+                    e_uid = str(cal.subcomponents[0]["UID"])
+                    self._uid_index[e_uid] = str(e.url)
+                    if e_uid == uid:
+                        found = e
             except Exception:
                 continue
-        raise NotFoundError("Event with UID not found")
+        if found is None:
+            raise NotFoundError("Event with UID not found")
+        return found
 
     def update_event(self, uid: str, patch: Dict[str, Any]) -> None:
         """
@@ -173,7 +288,6 @@ class AldenCalDAV:
         comp = cal.subcomponents[0]
 
         # Replace fields if present
-        tzinfo = _tz()
         if "summary" in patch:
             comp["SUMMARY"] = vText(patch["summary"])
         if "description" in patch:
@@ -181,9 +295,9 @@ class AldenCalDAV:
         if "location" in patch:
             comp["LOCATION"] = vText(patch["location"] or "")
         if "start" in patch:
-            comp["DTSTART"] = patch["start"].astimezone(tzinfo)
+            comp["DTSTART"] = patch["start"].astimezone(_TZ)
         if "end" in patch:
-            comp["DTEND"] = patch["end"].astimezone(tzinfo)
+            comp["DTEND"] = patch["end"].astimezone(_TZ)
         if "rrule" in patch:
             if patch["rrule"]:
                 comp["RRULE"] = patch["rrule"]
@@ -208,9 +322,8 @@ class AldenCalDAV:
 
         if "x_alden" in patch:
             # remove prior X-ALDEN-* then add
-            for k in list(comp.keys()):
-                if k.startswith("X-ALDEN-"):
-                    del comp[k]
+            for k in [k for k in comp if k.startswith("X-ALDEN-")]:
+                del comp[k]
             for k, v in (patch["x_alden"] or {}).items():
                 comp.add(f"X-ALDEN-{k.upper()}", v)
 
@@ -220,6 +333,7 @@ class AldenCalDAV:
     def delete_event(self, uid: str) -> None:
         ev = self.get_event_by_uid(uid)
         ev.delete()
+        self._uid_index.pop(uid, None)
 
     # -------------------------
     # Queries
@@ -229,9 +343,8 @@ class AldenCalDAV:
                             end: datetime) -> List[Dict[str, Any]]:
         """Return minimal dicts (fast + easy for planning)."""
         results = []
-        tzinfo = _tz()
-        start = start.astimezone(tzinfo)
-        end = end.astimezone(tzinfo)
+        start = start.astimezone(_TZ)
+        end = end.astimezone(_TZ)
         for e in self.calendar.date_search(start, end):
             try:
                 cal = e.icalendar_instance
@@ -245,12 +358,84 @@ class AldenCalDAV:
                     "description": str(comp.get("DESCRIPTION", "")) if comp.get("DESCRIPTION") else "",
                     "rrule": str(comp.get("RRULE")) if comp.get("RRULE") else None,
                     "categories": list(comp.get("CATEGORIES", [])) if comp.get("CATEGORIES") else [],
-                    "x_alden": {k[8:].lower(): str(comp.get(k)) for k in comp.keys() if k.startswith("X-ALDEN-")},
+                    "x_alden": {k[8:].lower(): str(v) for k, v in comp.items() if k.startswith("X-ALDEN-")},
                 })
             except Exception:
                 continue
         return results
 
+    def event_resources(self, start: datetime, end: datetime):
+        """Raw CalDAV event resources (with .data/.url) overlapping [start, end]."""
+        return self.calendar.date_search(start.astimezone(_TZ), end.astimezone(_TZ))
+
+    def event_etags(self, start: datetime, end: datetime) -> List[Any]:
+        """
+        Resources overlapping [start, end] with only url + ETag loaded.
+        A calendar-query REPORT with a server-side time-range filter that
+        asks for getetag alone, so no calendar-data comes back.
+        """
+        query = cdav.CalendarQuery() + [
+            dav.Prop() + dav.GetEtag(),
+            cdav.Filter() + (cdav.CompFilter("VCALENDAR") + (cdav.CompFilter("VEVENT") + cdav.TimeRange(start, end))),
+        ]
+        # caldav has no public etag-only query; this is what objects_by_sync_token uses
+        _, objs = self.calendar._request_report_build_resultlist(query, props=[dav.GetEtag()], no_calendardata=True)
+        return objs
+
+    def load_resources(self, resources: Iterable[Any]) -> List[Any]:
+        """
+        Fill in .data for url-only resources with calendar-multiget,
+        MULTIGET_PAGE hrefs per REPORT. Resources the server no longer has
+        are left out of the result.
+        """
+        resources = list(resources)
+        for i in range(0, len(resources), MULTIGET_PAGE):
+            page = resources[i:i + MULTIGET_PAGE]
+            by_url = {r.url.canonical(): r for r in page}
+            for href, data in self.calendar._multiget([r.url for r in page]):
+                # resolve hrefs the same way caldav does when it builds resource URLs
+                url = URL(href) if URL(href).hostname else quote(href)
+                res = by_url.get(self.calendar.url.join(url).canonical())
+                if res is not None and data:
+                    res.data = data
+        return [r for r in resources if r.data]
+
+    def sync_resources(self, token: Optional[str], load: bool = True) -> Tuple[Optional[str], List[Any], List[str]]:
+        """
+        WebDAV-Sync (RFC 6578) delta since `token`:
+        returns (new_token, changed resources, deleted hrefs).
+        With load=False nothing is downloaded: changed holds url + ETag
+        stubs (for token=None, the whole calendar) and deleted is empty.
+        Raises if the server can't sync-collection.
+        """
+        coll = self.calendar.objects_by_sync_token(sync_token=token, load_objects=False)
+        changed, deleted = [], []
+        if not load:
+            changed = list(coll)
+        else:
+            def fetch(obj):
+                try:
+                    obj.load(only_if_unloaded=True)
+                    return True
+                except NotFoundError:
+                    return False
+            # one GET per changed object; overlap them instead of paying each round trip in turn
+            objs = list(coll)
+            with ThreadPoolExecutor(max_workers=max(1, min(CALDAV_FETCH_WORKERS, len(objs)))) as pool:
+                for obj, found in zip(objs, pool.map(fetch, objs)):
+                    if found:
+                        changed.append(obj)
+                    else:
+                        deleted.append(str(obj.url))
+        return coll.sync_token, changed, deleted
+
+    def get_ctag(self) -> Optional[str]:
+        """Calendar CTag, or None if the server doesn't publish one."""
+        try:
+            return self.calendar.get_property(_GetCTag())
+        except Exception:
+            return None
+
     def sync_token(self) -> Optional[str]:
         """Get or initialize sync token (if server supports it)."""
         try:
@@ -1,52 +1,265 @@
-import asyncio, hashlib
-from datetime import datetime, timedelta, timezone
-from icalendar import Calendar
-from alden_main.models.models_calendar import EventCache
+import asyncio, hashlib, re
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from icalendar import Calendar, vDDDTypes
+from icalendar.parser import unescape_char
+from alden_main.main_agents.caldav_client import sync_token_rejected
+from alden_main.models.models_calendar import EventCache, SyncState
 from sqlalchemy.orm import Session
 
-def _hash(ics: str) -> str:
-    return hashlib.sha256(ics.encode()).hexdigest()
+def _hash(ics) -> str:
+    if isinstance(ics, str): ics = ics.encode()
+    # change detection only, not security; lets OpenSSL 3 skip the FIPS path
+    return hashlib.sha256(ics, usedforsecurity=False).hexdigest()
 
-def _extract_dt(comp, key):
-    val = comp.get(key)
-    if not val: return None, 'UTC', False
-    dt = val.dt
+def _norm_dt(dt):
+    if dt is None: return None, 'UTC', False
     if hasattr(dt, 'tzinfo') and dt.tzinfo: return dt, dt.tzinfo.tzname(None) or 'UTC', False
     # date-only (all-day)
     return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc), 'UTC', True
 
-async def poll_loop(caldav, session_factory, seconds=60):
-    while True:
+_HEAD_KEYS = ('UID', 'SUMMARY', 'DTSTART', 'DTEND')
+
+def _split_prop(line: str):
+    """'DTSTART;TZID="Europe/Berlin":2025...' -> ('DTSTART', {'TZID': 'Europe/Berlin'}, '2025...')."""
+    head, sep, value = line.partition(':')
+    if '"' in head:
+        # a quoted param value may itself contain ':' - find the first one outside quotes
+        quoted = False
+        for i, ch in enumerate(line):
+            if ch == '"': quoted = not quoted
+            elif ch == ':' and not quoted: break
+        head, value = line[:i], line[i + 1:]
+    name, *params = head.split(';')
+    return name.upper(), dict((k.upper(), v.strip('"')) for k, _, v in (p.partition('=') for p in params)), value
+
+_DT_RE = re.compile(r'(\d{4})(\d\d)(\d\d)(?:T(\d\d)(\d\d)(\d\d)(Z)?)?')
+
+def _ical_dt(value: str, tzid):
+    """DATE / DATE-TIME by slicing the digits; anything else goes through icalendar."""
+    m = _DT_RE.fullmatch(value)
+    if m is None:
+        return vDDDTypes.from_ical(value, timezone=tzid)
+    y, mo, d, hh, mi, ss, z = m.groups()
+    if hh is None:
+        return date(int(y), int(mo), int(d))
+    # unknown TZIDs raise ZoneInfoNotFoundError, which sends the caller to the full parse
+    tz = timezone.utc if z else ZoneInfo(tzid) if tzid else None
+    return datetime(int(y), int(mo), int(d), int(hh), int(mi), int(ss), tzinfo=tz)
+
+def _fast_vevent_head(ics):
+    """
+    Read UID/SUMMARY/DTSTART/DTEND off the first VEVENT with one line scan,
+    skipping nested components (VALARM etc). Returns None whenever the
+    cheap path can't be trusted so the caller falls back to Calendar.from_ical.
+    """
+    if isinstance(ics, bytes):
         try:
+            ics = ics.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+    # RFC 5545 unfolding: CRLF (or bare LF) followed by one space/tab continues the line
+    ics = ics.replace('\r\n ', '').replace('\r\n\t', '').replace('\n ', '').replace('\n\t', '')
+    props, depth, inside = {}, 0, False
+    for line in ics.splitlines():
+        if not inside:
+            inside = line.upper() == 'BEGIN:VEVENT'
+            continue
+        name, params, value = _split_prop(line)
+        if name == 'BEGIN': depth += 1
+        elif name == 'END':
+            if depth == 0: break
+            depth -= 1
+        elif depth == 0 and name in _HEAD_KEYS and name not in props:
+            props[name] = (params, value)
+    if 'UID' not in props or 'DTSTART' not in props:
+        return None
+    try:
+        head = {'uid': unescape_char(props['UID'][1]), 'summary': unescape_char(props.get('SUMMARY', ({}, ''))[1])}
+        for key in ('DTSTART', 'DTEND'):
+            if key not in props:
+                head[key.lower()] = None
+                continue
+            params, value = props[key]
+            tzid = params.get('TZID')
+            dt = _ical_dt(value, tzid)
+            # a TZID icalendar couldn't resolve (custom VTIMEZONE) comes back naive
+            if tzid and isinstance(dt, datetime) and dt.tzinfo is None:
+                return None
+            head[key.lower()] = dt
+    except Exception:
+        return None
+    return head
+
+def _parse_head(ics):
+    head = _fast_vevent_head(ics)
+    if head is not None:
+        return head['uid'], head['summary'], head['dtstart'], head['dtend']
+    try:
+        comps = [c for c in Calendar.from_ical(ics).walk('VEVENT')]
+    except Exception as e:
+        # one unreadable resource shouldn't abort the whole tick
+        print(f"[calendar poll] skipping unparsable resource: {e}")
+        return None
+    if not comps: return None
+    comp = comps[0]
+    start, end = comp.get('DTSTART'), comp.get('DTEND')
+    return (str(comp.get('UID')), str(comp.get('SUMMARY') or ''),
+            start.dt if start else None, end.dt if end else None)
+
+def _etag(res) -> str:
+    props = getattr(res, 'props', None) or {}
+    return props.get('{DAV:}getetag') or getattr(res, 'etag', '') or ''
+
+_IN_CHUNK = 500  # stay well under SQLite's bound-parameter limit
+
+def _rows_where_in(s: Session, column, values):
+    values = list(values)
+    for i in range(0, len(values), _IN_CHUNK):
+        yield from s.query(EventCache).filter(column.in_(values[i:i + _IN_CHUNK]))
+
+def _ingest(s: Session, resources) -> None:
+    """Upsert resources into EventCache. Two prefetch queries, no commit (caller commits)."""
+    resources = list(resources)
+    hrefs = [str(getattr(res, 'url', '')) for res in resources]
+    cached = {r.href: r for r in _rows_where_in(s, EventCache.href, hrefs)}
+
+    parsed = []
+    for res, url in zip(resources, hrefs):
+        etag = _etag(res)
+        row = cached.get(url)
+        # The server's ETag is authoritative: unchanged means skip hash + parse.
+        if etag and row is not None and row.etag == etag:
+            continue
+        ics = res.data
+        n, h = len(ics), None
+        if not etag and row is not None and row.content_len == n:
+            # ETag-less server: a different length already proves a change,
+            # so only same-length bodies need hashing. The hash is stored
+            # lazily, the first time a length match needs it.
+            h = _hash(ics)
+            if row.content_hash == h:
+                continue
+        head = _parse_head(ics)
+        if head is None: continue
+        uid, summary, start, end = head
+        dtstart, tzid, all_day = _norm_dt(start)
+        dtend, _, _ = _norm_dt(end)
+        parsed.append(dict(href=url, uid=uid, etag=etag, summary=summary,
+                           dtstart=dtstart, dtend=dtend, tzid=tzid,
+                           all_day=all_day, content_hash=h, content_len=n))
+    if not parsed:
+        return
+
+    by_uid = {r.uid: r for r in _rows_where_in(s, EventCache.uid, {p['uid'] for p in parsed})}
+    for p in parsed:
+        row = by_uid.get(p['uid'])
+        if not row:
+            row = by_uid[p['uid']] = EventCache(source='unknown', **p)
+            s.add(row)
+        else:
+            # the UID may have moved to a new resource; follow it so later
+            # href lookups (ETag skip, deletes) hit this row
+            row.href = p['href']
+            if (row.etag != p['etag']) if p['etag'] else (row.content_len, row.content_hash) != (p['content_len'], p['content_hash']):
+                row.summary = p['summary']; row.dtstart = p['dtstart']; row.dtend = p['dtend']
+                row.tzid = p['tzid']; row.all_day = p['all_day']; row.etag = p['etag']
+                row.content_hash = p['content_hash']; row.content_len = p['content_len']
+
+def _sync_state(s: Session, calendar_url: str) -> SyncState:
+    state = s.query(SyncState).filter_by(calendar_url=calendar_url).one_or_none()
+    if state is None:
+        state = SyncState(calendar_url=calendar_url)
+        s.add(state)
+    return state
+
+def _stale(s: Session, stubs) -> list:
+    """Stubs (url + ETag) whose ETag differs from the cache, or that have none."""
+    cached = {r.href: r.etag for r in _rows_where_in(s, EventCache.href, [str(r.url) for r in stubs])}
+    return [r for r in stubs if not _etag(r) or cached.get(str(r.url)) != _etag(r)]
+
+def _prune(s: Session, listed, start=None, end=None) -> None:
+    """
+    Delete cached rows whose href the server no longer lists. With a window,
+    only rows starting inside it are considered, since a window listing
+    says nothing about events outside it.
+    """
+    q = s.query(EventCache.href)
+    if start is not None:
+        q = q.filter(EventCache.dtstart >= start, EventCache.dtstart < end)
+    gone = [h for (h,) in q if h not in listed]
+    for i in range(0, len(gone), _IN_CHUNK):
+        s.query(EventCache).filter(EventCache.href.in_(gone[i:i + _IN_CHUNK])).delete(synchronize_session=False)
+
+def sync_once(caldav, session_factory) -> None:
+    """
+    One blocking pass pulling CalDAV into EventCache. An unchanged CTag
+    skips the pass. With a stored WebDAV-Sync token only the delta is
+    fetched. Without one (cold start, or a rejected token) the whole
+    calendar is listed by href + ETag and only stale bodies are loaded;
+    servers that can't sync get the event window rescanned every tick.
+    """
+    with session_factory() as s:
+        state = _sync_state(s, str(caldav.calendar.url))
+
+        # Idle calendars are the common case: one PROPFIND and we're done
+        ctag = caldav.get_ctag()
+        if ctag and ctag == state.ctag:
+            return
+
+        if state.sync_token:
+            try:
+                token, changed, deleted = caldav.sync_resources(state.sync_token)
+            except Exception as e:
+                # transport/server errors propagate so the token is retried next tick
+                if not sync_token_rejected(e):
+                    raise
+                print(f"[calendar poll] sync token rejected, relisting: {e}")
+                state.sync_token = None
+            else:
+                _ingest(s, changed)
+                # flush first so a UID that moved href in this delta is already
+                # re-pointed and its old href's delete can't remove it
+                s.flush()
+                gone = set(deleted) - {str(r.url) for r in changed}
+                if gone:
+                    s.query(EventCache).filter(EventCache.href.in_(list(gone))).delete(synchronize_session=False)
+                state.sync_token, state.ctag = token, ctag
+                s.commit()
+                return
+
+        try:
+            # token=None lists every object (href + ETag) with the token to resume from
+            token, stubs, _ = caldav.sync_resources(None, load=False)
+        except Exception:
+            token = None
+        if token is not None:
+            _ingest(s, caldav.load_resources(_stale(s, stubs)))
+            s.flush()
+            _prune(s, {str(r.url) for r in stubs})
+        else:
             now = datetime.now(timezone.utc)
             start, end = now - timedelta(days=14), now + timedelta(days=90)
-            resources = caldav.list_events(start, end)
-            with session_factory() as s:
-                for res in resources:
-                    ics = res.data
-                    h = _hash(ics)
-                    etag = getattr(res, 'etag', '') or ''
-                    url = str(getattr(res, 'url', ''))
-                    cal = Calendar.from_ical(ics)
-                    comps = [c for c in cal.walk('VEVENT')]
-                    if not comps: continue
-                    comp = comps[0]
-                    uid = str(comp.get('UID'))
-                    summary = str(comp.get('SUMMARY') or '')
-                    dtstart, tzid, all_day = _extract_dt(comp, 'DTSTART')
-                    dtend, _, _ = _extract_dt(comp, 'DTEND')
-
-                    row = s.query(EventCache).filter_by(uid=uid).one_or_none()
-                    if not row:
-                        row = EventCache(href=url, uid=uid, etag=etag, summary=summary,
-                                         dtstart=dtstart, dtend=dtend, tzid=tzid,
-                                         all_day=all_day, content_hash=h, source='unknown')
-                        s.add(row)
-                    else:
-                        if row.content_hash != h or row.etag != etag:
-                            row.summary = summary; row.dtstart = dtstart; row.dtend = dtend
-                            row.tzid = tzid; row.all_day = all_day; row.etag = etag; row.content_hash = h
-                    s.commit()
+            try:
+                # hrefs + ETags first; only download bodies that differ from the cache
+                stubs = caldav.event_etags(start, end)
+            except Exception:
+                resources = list(caldav.event_resources(start, end))
+                _ingest(s, resources)
+            else:
+                resources = stubs
+                _ingest(s, caldav.load_resources(_stale(s, stubs)))
+            s.flush()
+            # stored dtstarts are wall-clock times, so keep a day clear of the edges
+            _prune(s, {str(r.url) for r in resources}, start + timedelta(days=1), end - timedelta(days=1))
+        state.sync_token, state.ctag = token, ctag
+        s.commit()
+
+async def poll_loop(caldav, session_factory, seconds=60):
+    while True:
+        try:
+            # CalDAV and SQLAlchemy are both blocking; keep them off the event loop
+            await asyncio.to_thread(sync_once, caldav, session_factory)
         except Exception as e:
             print(f"[calendar poll] {e}")
-        await asyncio.sleep(seconds)
\ No newline at end of file
+        await asyncio.sleep(seconds)
@@ -1,15 +1,52 @@
 import sqlite3
 import datetime
 import json
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
 
 DB_PATH = "/var/lib/alden/alden.db"
 
+# -----------------------
+# CONNECTION
+# -----------------------
+# One connection for the whole process. sqlite3 serializes writes anyway,
+# so a lock around it is cheaper than connect()+fsync+close per insert.
+_CONN: Optional[sqlite3.Connection] = None
+_LOCK = threading.Lock()
+
+def _get_conn() -> sqlite3.Connection:
+    """Return the shared connection, opening it on first use. Hold _LOCK."""
+    global _CONN
+    if _CONN is None:
+        con = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+        con.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA temp_store=MEMORY;"
+            "PRAGMA cache_size=-65536;"  # 64 MiB page cache
+            "PRAGMA mmap_size=268435456;"
+        )
+        _CONN = con
+    return _CONN
+
+def close_db() -> None:
+    global _CONN
+    with _LOCK:
+        if _CONN is not None:
+            _CONN.close()
+            _CONN = None
+
 # -----------------------
 # DB INIT
 # -----------------------
+_DB_READY = False
+
 def init_db():
-    with sqlite3.connect(DB_PATH) as con:
+    global _DB_READY
+    if _DB_READY:
+        return
+    with _LOCK, _get_conn() as con:
         con.execute("""CREATE TABLE IF NOT EXISTS location_events (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_id TEXT,
@@ -39,10 +76,18 @@ def init_db():
             created_at REAL,
             stored_at TEXT
         )""")
+        _DB_READY = True
     print("✅ DB initialized")
 
+# stored_at is only meaningful to the second; rebuild the string once per second
+_ts_cache = [0, ""]
+
 def _utc_now_iso() -> str:
-    return datetime.datetime.utcnow().isoformat()
+    now = int(time.time())
+    if _ts_cache[0] != now:
+        # naive UTC truncated to the second (older rows carried microseconds)
+        _ts_cache[:] = [now, datetime.datetime.fromtimestamp(now, datetime.timezone.utc).replace(tzinfo=None).isoformat()]
+    return _ts_cache[1]
 
 # -----------------------
 # VALIDATORS
@@ -68,6 +113,18 @@ VALIDATORS = {
 # -----------------------
 # STORE FUNCTIONS
 # -----------------------
+_SQL_INS_LOCATION = """INSERT INTO location_events
+           (device_id, platform, event, latitude, longitude, address, ts, stored_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
+_SQL_INS_USAGE = """INSERT INTO usage_events
+           (device_id, ts, platform, event, app, title, stored_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+_SQL_INS_USER = """INSERT OR REPLACE INTO users
+           (user_id, name, email, created_at, stored_at)
+           VALUES (?, ?, ?, ?, ?)"""
+
 def _to_epoch(ts_value):
     """Accept datetime or str and return epoch seconds"""
     if isinstance(ts_value, datetime.datetime):
@@ -80,9 +137,7 @@ def _store_location(con: sqlite3.Connection, payload: Dict[str, Any]) -> int:
     ts = _to_epoch(payload["ts"])
     coords = payload["coords"]
     cur = con.execute(
-        """INSERT INTO location_events
-           (device_id, platform, event, latitude, longitude, address, ts, stored_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        _SQL_INS_LOCATION,
         (
             payload["device_id"],
             payload.get("platform"),
@@ -99,9 +154,7 @@ def _store_location(con: sqlite3.Connection, payload: Dict[str, Any]) -> int:
 def _store_usage(con: sqlite3.Connection, payload: Dict[str, Any]) -> int:
     ts = _to_epoch(payload["ts"])
     cur = con.execute(
-        """INSERT INTO usage_events
-           (device_id, ts, platform, event, app, title, stored_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        _SQL_INS_USAGE,
         (
             payload["device_id"],
             ts,
@@ -117,9 +170,7 @@ def _store_usage(con: sqlite3.Connection, payload: Dict[str, Any]) -> int:
 def _store_user(con: sqlite3.Connection, payload: Dict[str, Any]) -> int:
     ts = _to_epoch(payload["created_at"])
     cur = con.execute(
-        """INSERT OR REPLACE INTO users
-           (user_id, name, email, created_at, stored_at)
-           VALUES (?, ?, ?, ?, ?)""",
+        _SQL_INS_USER,
         (
             payload["user_id"],
             payload.get("name"),
@@ -147,5 +198,28 @@ def validate(category: str, payload: Dict[str, Any]) -> None:
 def store_data(category: str, payload: Dict[str, Any]) -> int:
     if category not in STORES:
         raise ValueError(f"unknown_category:{category}")
-    with sqlite3.connect(DB_PATH) as con:
+    with _LOCK, _get_conn() as con:
         return STORES[category](con, payload)
+
+def store_data_many(items: List[Tuple[str, Dict[str, Any]]]) -> List[Union[int, Exception]]:
+    """
+    Store several (category, payload) pairs in a single transaction.
+    Each row gets its own savepoint, so a bad row is rolled back alone and
+    comes back as its exception instead of a row id.
+    """
+    results: List[Union[int, Exception]] = []
+    with _LOCK, _get_conn() as con:
+        # take the write lock up front instead of upgrading mid-batch
+        con.execute("BEGIN IMMEDIATE")
+        for category, payload in items:
+            if category not in STORES:
+                results.append(ValueError(f"unknown_category:{category}"))
+                continue
+            con.execute("SAVEPOINT row")
+            try:
+                results.append(STORES[category](con, payload))
+            except Exception as e:
+                con.execute("ROLLBACK TO row")
+                results.append(e)
+            con.execute("RELEASE row")
+    return results
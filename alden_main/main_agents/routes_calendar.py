@@ -1,8 +1,9 @@
 # alden_main/main_agents/routes_calendar.py
 from __future__ import annotations
 
+import time
 from datetime import datetime
-from typing import Generator, List, Optional
+from typing import Generator, List, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
@@ -34,6 +35,21 @@ def get_db(request: Request) -> Generator:
         db.close()
 
 
+# Calendar URLs, refreshed at most every CALENDARS_TTL seconds. Cached on
+# app.state next to the client they came from.
+CALENDARS_TTL = 30.0
+
+
+def _calendar_urls(request: Request, caldav: AldenCalDAV) -> List[str]:
+    hit: Optional[Tuple[float, List[str]]] = getattr(request.app.state, "calendar_urls", None)
+    now = time.monotonic()
+    if hit is not None and now - hit[0] < CALENDARS_TTL:
+        return hit[1]
+    urls = [str(getattr(c, "url", c)) for c in caldav.get_calendars()]
+    request.app.state.calendar_urls = (now, urls)
+    return urls
+
+
 # ---------- Schemas ----------
 class CreateEventBody(BaseModel):
     summary: str
@@ -49,18 +65,18 @@ class CreateEventBody(BaseModel):
 
 # ---------- Routes ----------
 @router.get("/health")
-def health(caldav: AldenCalDAV = Depends(get_caldav)):
+def health(request: Request, caldav: AldenCalDAV = Depends(get_caldav)):
     # Light touch to verify connectivity without crashing
     try:
-        _ = caldav.get_calendars()
+        _calendar_urls(request, caldav)
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
 
 @router.get("/calendars")
-def list_cals(caldav: AldenCalDAV = Depends(get_caldav)):
-    return [getattr(c, "url", str(c)) for c in caldav.get_calendars()]
+def list_cals(request: Request, caldav: AldenCalDAV = Depends(get_caldav)):
+    return _calendar_urls(request, caldav)
 
 
 @router.post("/events")
@@ -89,7 +105,7 @@ def list_events(
     day_end: datetime,
     caldav: AldenCalDAV = Depends(get_caldav),
 ):
-    return caldav.list_events_between(day_start, day_end)
+    return caldav.list_events(day_start, day_end)
 
 
 @router.patch("/events/{uid}")
@@ -120,6 +136,7 @@ def mount_calendar_routes(app, SessionLocal, caldav: AldenCalDAV) -> None:
         mount_calendar_routes(app, SessionLocal, caldav)
     """
     app.state.caldav = caldav
+    app.state.calendar_urls = None  # belongs to the previous client, if any
     app.state.SessionLocal = SessionLocal  # optional but handy for future endpoints
     app.include_router(router)
 
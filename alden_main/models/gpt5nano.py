@@ -1,12 +1,21 @@
 # gpt5nano_model.py
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import os
 from openai import OpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+_client: Optional[OpenAI] = None
+
+def _get_client() -> OpenAI:
+    """Build the OpenAI client once so its HTTP connection pool is reused."""
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY_5NANO"))
+    return _client
+
 def run_gpt5nano(messages: List[Dict[str, str]], *, debug: bool = False) -> str:
     """
     Minimal wrapper for GPT-5-nano.
@@ -16,7 +25,7 @@ def run_gpt5nano(messages: List[Dict[str, str]], *, debug: bool = False) -> str:
         print(f"[GPT5-NANO] Messages: {messages}")
 
     # ---- LIVE CALL----
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY_5NANO"))
+    client = _get_client()
     resp = client.chat.completions.create(
         model="gpt-5-nano",
         messages=messages
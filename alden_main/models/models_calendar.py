@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, UniqueConstraint, inspect, text
 from sqlalchemy.sql import func
 
 Base = declarative_base()
@@ -8,7 +8,7 @@ class EventCache(Base):
     __tablename__ = "event_cache"
     id = Column(Integer, primary_key=True)
     href = Column(String, unique=True)          # CalDAV resource URL
-    uid = Column(String, index=True)
+    uid = Column(String)                         # uc_uid below already indexes it
     etag = Column(String, index=True)
     summary = Column(String)
     dtstart = Column(DateTime(timezone=True))
@@ -16,6 +16,7 @@ class EventCache(Base):
     all_day = Column(Boolean, default=False)
     tzid = Column(String)
     content_hash = Column(String)
+    content_len = Column(Integer, nullable=True)  # ICS length; cheap change check before hashing
     source = Column(String)                      # 'alden'|'ios'|'unknown'
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
     __table_args__ = (UniqueConstraint('uid', name='uc_uid'),)
@@ -38,4 +39,35 @@ class ChangeLog(Base):
     old_time = Column(String, nullable=True)
     new_time = Column(String, nullable=True)
     reason = Column(Text, nullable=True)
-    at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SyncState(Base):
+    __tablename__ = "calendar_sync_state"
+    id = Column(Integer, primary_key=True)
+    calendar_url = Column(String, unique=True)
+    sync_token = Column(String, nullable=True)   # WebDAV-Sync token from the last poll
+    ctag = Column(String, nullable=True)         # collection CTag seen by the last poll
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+
+def add_missing_columns(engine) -> None:
+    """create_all() never alters existing tables; add any nullable columns the models gained since."""
+    insp = inspect(engine)
+    with engine.begin() as con:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name not in have and col.nullable:
+                    con.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}'))
+
+# Indexes older schemas created that the models no longer declare
+_STALE_INDEXES = (
+    "ix_event_cache_uid",  # duplicated the uc_uid unique index
+)
+
+def drop_stale_indexes(engine) -> None:
+    """Drop indexes the models have shed, so existing databases stop maintaining them."""
+    with engine.begin() as con:
+        for name in _STALE_INDEXES:
+            con.execute(text(f"DROP INDEX IF EXISTS {name}"))
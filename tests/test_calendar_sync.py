@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from caldav.lib.error import ReportError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from alden_main.main_agents import calendar_sync
+from alden_main.models.models_calendar import Base, EventCache, SyncState
+
+CAL_URL = "http://dav.example/cal/alden/"
+
+
+def _ics(uid, summary="Standup", start=datetime(2025, 1, 1, 10, tzinfo=timezone.utc)):
+    return (
+        "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nBEGIN:VEVENT\r\n"
+        f"UID:{uid}\r\nSUMMARY:{summary}\r\n"
+        f"DTSTART:{start:%Y%m%dT%H%M%SZ}\r\nDTEND:{start + timedelta(hours=1):%Y%m%dT%H%M%SZ}\r\n"
+        "END:VEVENT\r\nEND:VCALENDAR\r\n"
+    )
+
+
+class FakeResource:
+    def __init__(self, href, etag, data=None):
+        self.url = CAL_URL + href
+        self.props = {"{DAV:}getetag": etag}
+        self.data = data
+
+
+class FakeCalDAV:
+    """Just enough of AldenCalDAV for sync_once; no CTag, ETag-only window scan."""
+
+    class calendar:
+        url = CAL_URL
+
+    def __init__(self, events, sync=True):
+        self.events = events  # href -> (etag, ics)
+        self.sync = sync      # False: server without sync-collection
+        self.delta = None     # (token, changed, deleted), or an exception to raise
+        self.loaded = []
+
+    def get_ctag(self):
+        return None
+
+    def sync_resources(self, token, load=True):
+        if not self.sync:
+            raise ReportError("501 Not Implemented")
+        if token is None:
+            return "t0", self.event_etags(None, None), []
+        if isinstance(self.delta, Exception):
+            raise self.delta
+        return self.delta
+
+    def event_etags(self, start, end):
+        def in_window(ics):
+            dtstart = calendar_sync._fast_vevent_head(ics)["dtstart"]
+            return start is None or start <= dtstart < end
+        return [FakeResource(href, etag) for href, (etag, ics) in self.events.items() if in_window(ics)]
+
+    def load_resources(self, resources):
+        resources = list(resources)
+        for r in resources:
+            r.data = self.events[r.url[len(CAL_URL):]][1]
+        self.loaded.extend(r.url for r in resources)
+        return resources
+
+
+def _session_factory():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine, expire_on_commit=False)
+
+
+def _rows(session_factory):
+    with session_factory() as s:
+        return [(r.uid, r.href, r.etag, r.summary) for r in s.query(EventCache)]
+
+
+def test_uid_moved_to_new_href_in_sync_delta_is_kept():
+    sf = _session_factory()
+    dav = FakeCalDAV({"a.ics": ('"1"', _ics("a"))})
+    calendar_sync.sync_once(dav, sf)
+    assert _rows(sf) == [("a", CAL_URL + "a.ics", '"1"', "Standup")]
+
+    # one delta carries both the event at its new href and the old href's deletion
+    moved = FakeResource("a2.ics", '"2"', _ics("a", "Standup (moved)"))
+    dav.delta = ("t1", [moved], [CAL_URL + "a.ics"])
+    calendar_sync.sync_once(dav, sf)
+
+    assert _rows(sf) == [("a", CAL_URL + "a2.ics", '"2"', "Standup (moved)")]
+
+
+def _forget_token(sf):
+    with sf() as s:
+        s.query(SyncState).update({SyncState.sync_token: None})
+        s.commit()
+
+
+def test_moved_href_is_not_refetched_by_relisting():
+    sf = _session_factory()
+    dav = FakeCalDAV({"a.ics": ('"1"', _ics("a"))})
+    calendar_sync.sync_once(dav, sf)
+
+    dav.events = {"a2.ics": ('"2"', _ics("a"))}
+    for _ in range(2):
+        _forget_token(sf)  # every tick takes the cold-start listing path
+        calendar_sync.sync_once(dav, sf)
+
+    assert _rows(sf) == [("a", CAL_URL + "a2.ics", '"2"', "Standup")]
+    assert dav.loaded == [CAL_URL + "a.ics", CAL_URL + "a2.ics"]
+
+
+def test_moved_href_is_not_refetched_by_window_scan():
+    sf = _session_factory()
+    now = datetime.now(timezone.utc)
+    dav = FakeCalDAV({"a.ics": ('"1"', _ics("a", start=now))}, sync=False)
+    calendar_sync.sync_once(dav, sf)
+
+    dav.events = {"a2.ics": ('"2"', _ics("a", start=now))}
+    calendar_sync.sync_once(dav, sf)
+    calendar_sync.sync_once(dav, sf)
+
+    assert [r[:3] for r in _rows(sf)] == [("a", CAL_URL + "a2.ics", '"2"')]
+    assert dav.loaded == [CAL_URL + "a.ics", CAL_URL + "a2.ics"]
+
+
+def test_cold_start_caches_events_beyond_the_window():
+    sf = _session_factory()
+    far = datetime.now(timezone.utc) + timedelta(days=100)
+    dav = FakeCalDAV({"far.ics": ('"1"', _ics("far", start=far))})
+    calendar_sync.sync_once(dav, sf)
+
+    assert [r[0] for r in _rows(sf)] == ["far"]
+
+
+def test_transport_error_keeps_the_sync_token():
+    sf = _session_factory()
+    dav = FakeCalDAV({"a.ics": ('"1"', _ics("a"))})
+    calendar_sync.sync_once(dav, sf)
+
+    dav.delta = TimeoutError("GET timed out")
+    with pytest.raises(TimeoutError):
+        calendar_sync.sync_once(dav, sf)
+
+    with sf() as s:
+        assert s.query(SyncState).one().sync_token == "t0"
+
+
+def test_rejected_token_relists_and_prunes_deleted_events():
+    sf = _session_factory()
+    dav = FakeCalDAV({"a.ics": ('"1"', _ics("a")), "b.ics": ('"1"', _ics("b"))})
+    calendar_sync.sync_once(dav, sf)
+
+    # b was deleted in a delta we never saw; the server no longer knows our token
+    del dav.events["b.ics"]
+    dav.delta = ReportError("403 Forbidden\n\n<D:error><D:valid-sync-token/></D:error>")
+    calendar_sync.sync_once(dav, sf)
+
+    assert [r[0] for r in _rows(sf)] == ["a"]
+    assert dav.loaded == [CAL_URL + "a.ics", CAL_URL + "b.ics"]
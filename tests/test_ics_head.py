@@ -0,0 +1,83 @@
+import pytest
+from icalendar import Calendar
+
+from alden_main.main_agents import calendar_sync
+
+
+def _vcal(*lines):
+    return "\r\n".join(("BEGIN:VCALENDAR", "VERSION:2.0", *lines, "END:VCALENDAR", ""))
+
+
+def _full_head(ics):
+    comp = Calendar.from_ical(ics).walk("VEVENT")[0]
+    start, end = comp.get("DTSTART"), comp.get("DTEND")
+    return (str(comp.get("UID")), str(comp.get("SUMMARY") or ""),
+            start.dt if start else None, end.dt if end else None)
+
+
+def _fast_head(ics):
+    head = calendar_sync._fast_vevent_head(ics)
+    assert head is not None, "fast path unexpectedly fell back"
+    return head["uid"], head["summary"], head["dtstart"], head["dtend"]
+
+
+FAST_CASES = {
+    "utc": _vcal(
+        "BEGIN:VEVENT", "UID:utc-1", "SUMMARY:Standup",
+        "DTSTART:20250101T100000Z", "DTEND:20250101T110000Z", "END:VEVENT"),
+    "tzid": _vcal(
+        "BEGIN:VEVENT", "UID:tz-1", "SUMMARY:Lunch",
+        "DTSTART;TZID=Europe/Berlin:20250101T120000",
+        'DTEND;TZID="Europe/Berlin":20250101T130000', "END:VEVENT"),
+    "all-day": _vcal(
+        "BEGIN:VEVENT", "UID:day-1", "SUMMARY:Holiday",
+        "DTSTART;VALUE=DATE:20250101", "DTEND;VALUE=DATE:20250102", "END:VEVENT"),
+    "valarm-first": _vcal(
+        "BEGIN:VEVENT",
+        "BEGIN:VALARM", "ACTION:EMAIL", "SUMMARY:Alarm subject", "UID:alarm-uid",
+        "TRIGGER:-PT5M", "END:VALARM",
+        "UID:alarm-1", "SUMMARY:Dentist",
+        "DTSTART:20250101T100000Z", "DTEND:20250101T110000Z", "END:VEVENT"),
+    "folded": _vcal(
+        "BEGIN:VEVENT", "UID:fold-", " 1", "SUMMARY:A very long summary that",
+        "  wraps onto a second line", "DTSTART:20250101T1000", "\t00Z", "END:VEVENT"),
+    "escaped": _vcal(
+        "BEGIN:VEVENT", "UID:a\\,b\\;c", "SUMMARY:Lunch\\, with Bob\\; bring\\ncake",
+        "DTSTART:20250101T100000Z", "END:VEVENT"),
+    "no-dtend": _vcal(
+        "BEGIN:VEVENT", "UID:open-1", "DTSTART:20250101T100000Z", "END:VEVENT"),
+}
+
+
+@pytest.mark.parametrize("ics", FAST_CASES.values(), ids=FAST_CASES.keys())
+def test_fast_head_matches_icalendar(ics):
+    assert _fast_head(ics) == _full_head(ics)
+
+
+FALLBACK_CASES = {
+    "windows-tzid": _vcal(
+        "BEGIN:VEVENT", "UID:win-1", "SUMMARY:Sync",
+        "DTSTART;TZID=Eastern Standard Time:20250101T100000",
+        "DTEND;TZID=Eastern Standard Time:20250101T110000", "END:VEVENT"),
+    "custom-vtimezone": _vcal(
+        "BEGIN:VTIMEZONE", "TZID:Custom/Office",
+        "BEGIN:STANDARD", "DTSTART:19700101T000000", "TZOFFSETFROM:+0200",
+        "TZOFFSETTO:+0200", "END:STANDARD", "END:VTIMEZONE",
+        "BEGIN:VEVENT", "UID:custom-1",
+        "DTSTART;TZID=Custom/Office:20250101T100000", "END:VEVENT"),
+    "missing-dtstart": _vcal(
+        "BEGIN:VEVENT", "UID:nostart-1", "SUMMARY:Todo-ish", "END:VEVENT"),
+}
+
+
+@pytest.mark.parametrize("ics", FALLBACK_CASES.values(), ids=FALLBACK_CASES.keys())
+def test_fallback_cases_use_icalendar(ics):
+    assert calendar_sync._fast_vevent_head(ics) is None
+    assert calendar_sync._parse_head(ics) == _full_head(ics)
+
+
+def test_non_utf8_body_falls_back():
+    ics = _vcal("BEGIN:VEVENT", "UID:latin-1", "SUMMARY:Caf\xe9",
+                "DTSTART:20250101T100000Z", "END:VEVENT").encode("latin-1")
+    assert calendar_sync._fast_vevent_head(ics) is None
+    assert calendar_sync._parse_head(ics)[0] == "latin-1"